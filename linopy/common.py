@@ -9,7 +9,8 @@ This module contains commonly used functions.
 from functools import wraps
 
 import numpy as np
-from xarray import DataArray, apply_ufunc, merge
+import pandas as pd
+from xarray import DataArray, Dataset, apply_ufunc, merge
 
 
 def _merge_inplace(self, attr, da, name, **kwargs):
@@ -19,10 +20,39 @@ def _merge_inplace(self, attr, da, name, **kwargs):
     This takes care of all coordinate alignments, instead of a direct
     assignment like self.variables[name] = var
     """
-    ds = merge([getattr(self, attr), da.rename(name)], **kwargs)
+    ds = getattr(self, attr)
+    if _is_aligned(ds, da):
+        # nothing to reindex, assemble the dataset from the underlying
+        # variables which skips aligning all existing data variables
+        data_vars = {k: v for k, v in ds.variables.items() if k not in ds.coords}
+        data_vars[name] = da.variable
+        coords = dict(ds.coords.variables)
+        for k, v in da.coords.variables.items():
+            coords.setdefault(k, v)
+        ds = Dataset(data_vars, coords, attrs=ds.attrs)
+    else:
+        ds = merge([ds, da.rename(name)], **kwargs)
     setattr(self, attr, ds)
 
 
+def _is_aligned(ds, da):
+    """
+    Check whether a dataarray can be assigned to a dataset without alignment.
+    """
+    if any(c not in da.dims for c in da.coords):
+        return False
+    ds_indexes = ds.indexes
+    da_indexes = da.indexes
+    for dim, size in da.sizes.items():
+        if dim not in ds.dims:
+            continue
+        if ds.dims[dim] != size or (dim in ds_indexes) != (dim in da_indexes):
+            return False
+        if dim in ds_indexes and not ds_indexes[dim].equals(da_indexes[dim]):
+            return False
+    return True
+
+
 def as_dataarray(arr):
     """
     Convert an object to a DataArray if it is not already a DataArray.
@@ -32,8 +62,106 @@ def as_dataarray(arr):
     return arr
 
 
+_NUMBA_KERNELS = None
+
+
+def _numba_kernels():
+    """
+    Get the numba kernels, compiled on first use.
+
+    Numba is imported lazily as importing it slows down the import of linopy
+    notably. Returns None if numba is not installed.
+    """
+    global _NUMBA_KERNELS
+    if _NUMBA_KERNELS is None:
+        try:
+            from numba import njit, prange
+        except ImportError:
+            _NUMBA_KERNELS = False
+            return None
+
+        @njit(parallel=True, cache=True)
+        def remap(out, array, mapping):
+            for i in prange(array.size):
+                out[i] = mapping[array[i]]
+
+        @njit(cache=True)
+        def ravel_and_filter(out, values, labels):
+            has_nan = False
+            k = 0
+            for i in range(labels.size):
+                if labels[i] != -1:
+                    v = values[i]
+                    has_nan |= v != v
+                    out[k] = v
+                    k += 1
+            return has_nan
+
+        _NUMBA_KERNELS = dict(remap=remap, ravel_and_filter=ravel_and_filter)
+    return _NUMBA_KERNELS or None
+
+
 def _remap(array, mapping):
-    return mapping[array.ravel()].reshape(array.shape)
+    # for large arrays a parallel gather pays off the numba dispatch overhead
+    if array.size > 100_000 and array.flags.c_contiguous:
+        kernels = _numba_kernels()
+        if kernels is not None:
+            out = np.empty(array.shape, dtype=mapping.dtype)
+            kernels["remap"](out.reshape(-1), array.reshape(-1), mapping)
+            return out
+    return np.take(mapping, array)
+
+
+def ravel_and_filter(values, labels, out=None, mask=None):
+    """
+    Flatten values and drop entries where labels are -1.
+
+    Values and labels must have the same shape. If given, the result is
+    written to `out` which must have the size of the non-missing labels.
+    A precomputed `mask` of the non-missing labels avoids scanning the
+    labels again.
+
+    Returns
+    -------
+    flat : np.array
+        Flattened values at non-missing labels.
+    has_nan : bool
+        Whether the flattened values contain nan's.
+    """
+    values = np.ravel(values)
+    labels = np.ravel(labels)
+    kernels = None
+    if (
+        values.size > 100_000
+        and values.dtype.kind in "biuf"
+        and (out is None or out.dtype.kind in "biuf")
+    ):
+        kernels = _numba_kernels()
+    if kernels is not None:
+        # fused single pass over labels and values
+        if out is None:
+            size = np.count_nonzero(labels != -1 if mask is None else mask)
+            out = np.empty(size, dtype=values.dtype)
+        has_nan = kernels["ravel_and_filter"](out, values, labels)
+        return out, bool(has_nan)
+    if mask is None:
+        mask = labels != -1
+    else:
+        mask = np.ravel(mask)
+    if out is not None and values.dtype == out.dtype:
+        flat = np.compress(mask, values, out=out)
+    else:
+        flat = values[mask]
+    if flat.dtype.kind in "biu":
+        has_nan = False
+    elif flat.dtype.kind == "f":
+        has_nan = bool(np.isnan(flat).any())
+    else:
+        has_nan = bool(pd.isna(flat).any())
+    if out is not None and flat is not out:
+        out[...] = flat
+        flat = out
+    return flat, has_nan
 
 
 def replace_by_map(ds, mapping):
@@ -49,13 +177,15 @@ def replace_by_map(ds, mapping):
     )
 
 
+_INT_DTYPES = (np.int8, np.int16, np.int32, np.int64)
+_INT_MAX = np.array([np.iinfo(t).max for t in _INT_DTYPES])
+
+
 def best_int(max_value):
     """
     Get the minimal int dtype for storing values <= max_value.
     """
-    for t in (np.int8, np.int16, np.int32, np.int64):
-        if max_value <= np.iinfo(t).max:
-            return t
+    return _INT_DTYPES[np.searchsorted(_INT_MAX, max_value)]
 
 
 def has_assigned_model(func):
@@ -79,9 +209,10 @@ def has_optimized_model(func):
 
     @wraps(func)
     def wrapper(self, *args, **kwargs):
-        if self.model is None:
+        model = self.model
+        if model is None:
             raise AttributeError("No reference model set.")
-        if self.model.status != "ok":
+        if model.status != "ok":
             raise AttributeError("Underlying model not optimized.")
         return func(self, *args, **kwargs)
 
@@ -6,7 +6,7 @@ This module contains implementations for the Constraint{s} class.
 """
 
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from itertools import product
 from typing import Any, Sequence, Union
 
@@ -27,6 +27,10 @@ from linopy.common import (
     replace_by_map,
 )
 
+# matches string between "Data variables" and "Attributes"/end of string
+_COORDS_PATTERN = re.compile(r"(?s)(?<=\<xarray\.Dataset\>\n).*?(?=Data variables:)")
+_DATA_PATTERN = re.compile(r"(?s)(?<=Data variables:).*?(?=($|\nAttributes))")
+
 
 class Constraint(DataArray):
     """
@@ -43,7 +47,8 @@ class Constraint(DataArray):
         # workaround until https://github.com/pydata/xarray/pull/5984 is merged
         if isinstance(args[0], DataArray):
             da = args[0]
-            args = (da.data, da.coords)
+            # pass the underlying variable to avoid re-wrapping the data
+            args = (da.variable, da.coords)
             kwargs.update({"attrs": da.attrs, "name": da.name})
 
         self.model = kwargs.pop("model", None)
@@ -226,12 +231,12 @@ class Constraints:
     A constraint container used for storing multiple constraint arrays.
     """
 
-    labels: Dataset = Dataset()
-    coeffs: Dataset = Dataset()
-    vars: Dataset = Dataset()
-    sign: Dataset = Dataset()
-    rhs: Dataset = Dataset()
-    blocks: Dataset = Dataset()
+    labels: Dataset = field(default_factory=Dataset)
+    coeffs: Dataset = field(default_factory=Dataset)
+    vars: Dataset = field(default_factory=Dataset)
+    sign: Dataset = field(default_factory=Dataset)
+    rhs: Dataset = field(default_factory=Dataset)
+    blocks: Dataset = field(default_factory=Dataset)
     model: Any = None  # Model is not defined due to circular imports
 
     dataset_attrs = ["labels", "coeffs", "vars", "sign", "rhs"]
@@ -250,14 +255,11 @@ class Constraints:
         r = "linopy.model.Constraints"
         line = "-" * len(r)
         r += f"\n{line}\n\n"
-        # matches string between "Data variables" and "Attributes"/end of string
-        coordspattern = r"(?s)(?<=\<xarray\.Dataset\>\n).*?(?=Data variables:)"
-        datapattern = r"(?s)(?<=Data variables:).*?(?=($|\nAttributes))"
         for (k, K) in zip(self.dataset_attrs, self.dataset_names):
             orig = getattr(self, k).__repr__()
             if k == "labels":
-                r += re.search(coordspattern, orig).group() + "\n"
-            data = re.search(datapattern, orig).group()
+                r += _COORDS_PATTERN.search(orig).group() + "\n"
+            data = _DATA_PATTERN.search(orig).group()
             # drop first line which includes counter for long ds
             data = data.split("\n", 1)[1]
             line = "-" * (len(K) + 1)
@@ -1045,6 +1045,14 @@ class Model:
         The optimal values of the variables are stored in `model.solution`.
         The optimal dual variables are stored in `model.dual`.
 
+        Setting the environment variable `LINOPY_CACHE_SOLVES=1` caches
+        successful solutions on disk, keyed by the model data, the solver name
+        and the solver options. The cache directory is set by `LINOPY_CACHE`
+        and defaults to 'linopy' in the user's cache directory. The cache is
+        bypassed if `log_fn`, `basis_fn` or `keep_files` is given. When a
+        cached solution is loaded, the solver is not called and
+        `model.solver_model` is None.
+
         Parameters
         ----------
         solver_name : str, optional
@@ -1069,11 +1077,16 @@ class Model:
             outputs are piped to the python repl.
         basis_fn : path_like, optional
             Path of the basis file of the solution which is written after
-            solving. The default None results in a temporary file, if the solver/method
-            supports writing out a basis file.
+            solving. If the basis cache is enabled by setting the environment
+            variable `LINOPY_CACHE_BASIS=1`, the default None results in a
+            temporary file in `model.solver_dir`, if the solver/method
+            supports writing out a basis file. Up to 16 of these cached basis
+            files are kept in `model.solver_dir` until the interpreter exits.
         warmstart_fn : path_like, optional
             Path of the basis file which should be used to warmstart the
-            solving. The default is None.
+            solving. If the basis cache is enabled, the default None results
+            in a warmstart from the cached basis of the last successful solve
+            of the identical problem file with the same solver.
         keep_files : bool, optional
             Whether to keep all temporary files like lp file, solution file.
             This argument is ignored for the logger file `log_fn`. The default
@@ -1134,6 +1147,12 @@ class Model:
 
         try:
             func = getattr(solvers, f"run_{solver_name}")
+            cache_dir = solvers.get_solution_cache_dir()
+            if cache_dir is not None and (log_fn or basis_fn or keep_files):
+                # a cached result would not produce the requested files
+                logger.info("Requested solver files, bypassing solution cache.")
+            elif cache_dir is not None:
+                func = solvers.cache_solution(func, solver_name, cache_dir)
             res = func(
                 self,
                 io_api,
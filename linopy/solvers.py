@@ -3,32 +3,40 @@
 """
 Linopy module for solving lp files with different solvers.
 """
+import atexit
+import hashlib
 import io
 import logging
 import os
+import pickle
 import re
+import shutil
 import subprocess as sub
+import sys
+from collections import OrderedDict
+from functools import wraps
+from itertools import takewhile
 from pathlib import Path
+from tempfile import NamedTemporaryFile
 
+import numpy as np
 import pandas as pd
 
-available_solvers = []
-
-if os.name == "nt":
-    which = "where"
-else:
-    which = "which"
-
-if sub.run([which, "glpsol"], stdout=sub.DEVNULL).returncode == 0:
-    available_solvers.append("glpk")
-
-if sub.run([which, "cbc"], stdout=sub.DEVNULL).returncode == 0:
-    available_solvers.append("cbc")
+# look up binaries on the PATH without spawning a process
+available_solvers = [
+    name for exe, name in [("glpsol", "glpk"), ("cbc", "cbc")] if shutil.which(exe)
+]
 
 try:
     import gurobipy
 
     available_solvers.append("gurobi")
+
+    _GUROBI_STATUSMAP = {
+        getattr(gurobipy.GRB.Status, s): s.lower()
+        for s in dir(gurobipy.GRB.Status)
+        if not s.startswith("_")
+    }
 except (ModuleNotFoundError, ImportError):
     pass
 
@@ -56,17 +64,239 @@ except (ModuleNotFoundError, ImportError):
 
 logger = logging.getLogger(__name__)
 
+_XPRESS_OPTIMAL = {"mip_optimal", "lp_optimal"}
+_XPRESS_INFEASIBLE_OR_UNBOUNDED = {
+    "mip_unbounded",
+    "mip_infeasible",
+    "lp_unbounded",
+    "lp_infeasible",
+    "lp_infeas",
+}
+
 
 io_structure = dict(
     lp_file={"gurobi", "xpress", "cbc", "glpk", "cplex"}, blocks={"pips"}
 )
 
 
+# strips everything but the number from glpk's objective line
+_NUMBER_FILTER = re.compile(r"[^0-9\.\+\-e]+")
+
+# basis files of previous successful solves, keyed by (solver, problem hash)
+_BASIS_CACHE = OrderedDict()
+_BASIS_CACHE_SIZE = 16
+
+
+def hash_file(fn):
+    """
+    Get the sha1 hex digest of the content of a file.
+    """
+    h = hashlib.sha1()
+    with open(fn, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _env_flag(name):
+    """
+    Check whether the boolean environment variable `name` is set.
+    """
+    return os.environ.get(name, "0").lower() not in ("", "0", "false")
+
+
+def basis_cache_enabled():
+    """
+    Check whether caching of basis files is enabled.
+
+    The cache is enabled by setting the environment variable
+    `LINOPY_CACHE_BASIS=1`.
+    """
+    return _env_flag("LINOPY_CACHE_BASIS")
+
+
+def lookup_basis(solver_name, problem_fn, warmstart_fn, basis_fn, solver_dir):
+    """
+    Get the warmstart and basis file for a problem file.
+
+    Only active if the basis cache is enabled, see `basis_cache_enabled`.
+    If no warmstart file is given, the basis of the last successful solve
+    of the same problem with the same solver is used. Problems are
+    identified by a hash of the problem file, hence only byte-identical
+    problem files reuse a basis, any modification of the model leads to a
+    cache miss. If no basis file is given, a temporary basis file is
+    assigned in `solver_dir`, which is cached after the solve by
+    `store_basis`. Up to 16 cached basis files are kept until the
+    interpreter exits.
+
+    Returns
+    -------
+    key : tuple or None
+        Key of the basis in the cache, None if the basis should not be cached.
+    warmstart_fn : path-like
+    basis_fn : path-like
+    """
+    if problem_fn is None or not basis_cache_enabled():
+        return None, warmstart_fn, basis_fn
+
+    key = (solver_name, hash_file(problem_fn))
+
+    if not warmstart_fn:
+        cached = _BASIS_CACHE.get(key)
+        if cached is not None and os.path.exists(cached):
+            logger.info(f"Warmstart from cached basis file {cached}.")
+            warmstart_fn = cached
+
+    if basis_fn:
+        # user-defined basis files are not managed by the cache
+        return None, warmstart_fn, basis_fn
+
+    kwargs = dict(
+        prefix="linopy-basis-",
+        suffix=".bas",
+        mode="w",
+        dir=solver_dir,
+        delete=False,
+    )
+    with NamedTemporaryFile(**kwargs) as f:
+        basis_fn = f.name
+    return key, warmstart_fn, basis_fn
+
+
+def store_basis(key, basis_fn, success=True):
+    """
+    Store a basis file assigned by `lookup_basis` in the cache.
+
+    Least recently used basis files are removed once the cache exceeds
+    its size limit. Empty basis files, i.e. if the solver did not write
+    a basis, and basis files of unsuccessful solves are removed directly.
+    """
+    if key is None:
+        return
+
+    if not success or not os.path.exists(basis_fn) or not os.path.getsize(basis_fn):
+        if os.path.exists(basis_fn):
+            os.remove(basis_fn)
+        return
+
+    previous = _BASIS_CACHE.pop(key, None)
+    if previous is not None and previous != basis_fn and os.path.exists(previous):
+        os.remove(previous)
+    _BASIS_CACHE[key] = basis_fn
+
+    while len(_BASIS_CACHE) > _BASIS_CACHE_SIZE:
+        _, fn = _BASIS_CACHE.popitem(last=False)
+        if os.path.exists(fn):
+            os.remove(fn)
+
+
+@atexit.register
+def clear_basis_cache():
+    """
+    Remove all cached basis files.
+    """
+    while _BASIS_CACHE:
+        _, fn = _BASIS_CACHE.popitem()
+        if os.path.exists(fn):
+            os.remove(fn)
+
+
+def hash_model(Model):
+    """
+    Get a digest of all model data which is written out to the problem file.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    datasets = [
+        Model.variables.labels,
+        Model.variables.lower,
+        Model.variables.upper,
+        Model.constraints.labels,
+        Model.constraints.coeffs,
+        Model.constraints.vars,
+        Model.constraints.sign,
+        Model.constraints.rhs,
+        Model.objective,
+    ]
+    for ds in datasets:
+        for name, da in ds.items():
+            values = np.asarray(da)
+            h.update(f"{name}{da.dims}{values.shape}{values.dtype}{da.attrs}".encode())
+            if values.dtype == object:
+                values = values.astype(str)
+            # hash the raw buffer, a byte view avoids copying the data
+            h.update(np.ascontiguousarray(values).reshape(-1).view(np.uint8))
+    return h.hexdigest()
+
+
+def get_solution_cache_dir():
+    """
+    Get the directory of the solution cache.
+
+    Caching of solutions is enabled by setting the environment variable
+    `LINOPY_CACHE_SOLVES=1`. The directory defaults to 'linopy' in the user's
+    cache directory (`XDG_CACHE_HOME` or '~/.cache') and can be set by the
+    environment variable `LINOPY_CACHE`. As cached results are unpickled,
+    the directory must be owned by the current user and must not be writable
+    by others. Returns None if caching is disabled or the directory is unsafe.
+    """
+    if not _env_flag("LINOPY_CACHE_SOLVES"):
+        return None
+
+    if "LINOPY_CACHE" in os.environ:
+        cache_dir = Path(os.environ["LINOPY_CACHE"])
+    else:
+        cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+        cache_dir = Path(cache_home) / "linopy"
+
+    cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if os.name == "posix":
+        stat = cache_dir.stat()
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+            logger.warning(
+                f"Solution cache directory {cache_dir} is not owned by the "
+                "current user or writable by others. Caching is disabled."
+            )
+            return None
+    return cache_dir
+
+
+def cache_solution(func, solver_name, cache_dir):
+    """
+    Wrap a solver function such that successful results are cached on disk.
+
+    Results are stored under a hash of the model data, the solver name and
+    the solver options. Solving an unchanged model again loads the stored
+    result instead of calling the solver. The solver model is not cached.
+    """
+
+    @wraps(func)
+    def wrapper(Model, *args, **solver_options):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(hash_model(Model).encode())
+        h.update(solver_name.encode())
+        h.update(repr(sorted(solver_options.items())).encode())
+        cache_fn = Path(cache_dir) / f"{h.hexdigest()}.pkl"
+
+        if cache_fn.exists():
+            logger.info(f"Loading cached solution from {cache_fn}.")
+            return pickle.loads(cache_fn.read_bytes())
+
+        res = func(Model, *args, **solver_options)
+        if res["status"] == "ok":
+            cached = {k: v for k, v in res.items() if k != "model"}
+            cache_fn.write_bytes(pickle.dumps(cached))
+        return res
+
+    return wrapper
+
+
 def set_int_index(series):
     """
     Convert string index to int index.
     """
-    series.index = series.index.str[1:].astype(int)
+    names = series.index.to_numpy()
+    labels = np.fromiter((int(n[1:]) for n in names), dtype=np.int64, count=len(names))
+    series.index = pd.Index(labels, copy=False)
     return series
 
 
@@ -77,6 +307,25 @@ def maybe_convert_path(path):
     return str(path.resolve()) if isinstance(path, Path) else path
 
 
+def run_command(command, log_fn=None):
+    """
+    Run a solver executable and wait for it to finish.
+
+    The output of the solver is written to `log_fn` if given. Otherwise it
+    is passed directly to the terminal, or forwarded line by line if
+    `sys.stdout` is redirected, e.g. in notebooks.
+    """
+    if log_fn is not None:
+        with open(log_fn, "w") as log_f:
+            sub.run(command, stdout=log_f, stderr=sub.STDOUT)
+    elif sys.stdout is sys.__stdout__:
+        sub.run(command)
+    else:
+        with sub.Popen(command, stdout=sub.PIPE, stderr=sub.STDOUT, text=True) as p:
+            for line in p.stdout:
+                print(line, end="")
+
+
 def run_cbc(
     Model,
     io_api=None,
@@ -103,32 +352,27 @@ def run_cbc(
         )
 
     problem_fn = Model.to_file(problem_fn)
+    basis_key, warmstart_fn, basis_fn = lookup_basis(
+        "cbc", problem_fn, warmstart_fn, basis_fn, Model.solver_dir
+    )
 
     # printingOptions is about what goes in solution file
-    command = f"cbc -printingOptions all -import {problem_fn} "
+    command = ["cbc", "-printingOptions", "all", "-import", str(problem_fn)]
 
     if warmstart_fn:
-        command += f"-basisI {warmstart_fn} "
+        command += ["-basisI", str(warmstart_fn)]
 
-    command += " ".join("-" + " ".join([k, str(v)]) for k, v in solver_options.items())
-    command += f"-solve -solu {solution_fn} "
+    for k, v in solver_options.items():
+        command += [f"-{k}", str(v)]
+    command += ["-solve", "-solu", str(solution_fn)]
 
     if basis_fn:
-        command += f"-basisO {basis_fn} "
+        command += ["-basisO", str(basis_fn)]
 
-    if not os.path.exists(solution_fn):
-        os.mknod(solution_fn)
+    # make sure the solution file exists even if cbc fails before writing it
+    Path(solution_fn).touch()
 
-    if log_fn is None:
-        p = sub.Popen(command.split(" "), stdout=sub.PIPE, stderr=sub.PIPE)
-        for line in iter(p.stdout.readline, b""):
-            print(line.decode(), end="")
-        p.stdout.close()
-        p.wait()
-    else:
-        log_f = open(log_fn, "w")
-        p = sub.Popen(command.split(" "), stdout=log_f, stderr=log_f)
-        p.wait()
+    run_command(command, log_fn)
 
     with open(solution_fn, "r") as f:
         data = f.readline()
@@ -143,26 +387,33 @@ def run_cbc(
         status = "warning"
         termination_condition = "other"
 
+    store_basis(basis_key, basis_fn, termination_condition == "optimal")
+
     if termination_condition != "optimal":
         return dict(status=status, termination_condition=termination_condition)
 
     objective = float(data[len("Optimal - objective value ") :])
 
-    with open(solution_fn, "rb") as f:
-        trimmed_sol_fn = re.sub(rb"\*\*\s+", b"", f.read())
-
-    data = pd.read_csv(
-        io.BytesIO(trimmed_sol_fn),
-        header=None,
-        skiprows=[0],
-        sep=r"\s+",
-        usecols=[1, 2, 3],
-        index_col=0,
-    )
-    variables_b = data.index.str[0] == "x"
-
-    solution = data[variables_b][2].pipe(set_int_index)
-    dual = data[~variables_b][3].pipe(set_int_index)
+    # rows are "<index> <name> <value> <dual>", infeasible ones prefixed by "**"
+    vlabels, values, clabels, duals = [], [], [], []
+    with open(solution_fn, "r") as f:
+        next(f)
+        for line in f:
+            row = line.split()
+            if not row:
+                continue
+            if row[0] == "**":
+                row = row[1:]
+            name = row[1]
+            if name[0] == "x":
+                vlabels.append(int(name[1:]))
+                values.append(float(row[2]))
+            else:
+                clabels.append(int(name[1:]))
+                duals.append(float(row[3]))
+
+    solution = pd.Series(values, vlabels, dtype=float)
+    dual = pd.Series(duals, clabels, dtype=float)
 
     return dict(
         status=status,
@@ -203,66 +454,55 @@ def run_glpk(
     problem_fn = Model.to_file(problem_fn)
 
     # TODO use --nopresol argument for non-optimal solution output
-    command = f"glpsol --lp {problem_fn} --output {solution_fn}"
+    command = ["glpsol", "--lp", str(problem_fn), "--output", str(solution_fn)]
     if log_fn is not None:
-        command += f" --log {log_fn}"
+        command += ["--log", str(log_fn)]
     if warmstart_fn:
-        command += f" --ini {warmstart_fn}"
+        command += ["--ini", str(warmstart_fn)]
     if basis_fn:
-        command += f" -w {basis_fn}"
-    command += " ".join("-" + " ".join([k, str(v)]) for k, v in solver_options.items())
-
-    p = sub.Popen(command.split(" "), stdout=sub.PIPE, stderr=sub.PIPE)
-    if log_fn is None:
-        for line in iter(p.stdout.readline, b""):
-            print(line.decode(), end="")
-        p.stdout.close()
-        p.wait()
-    else:
-        p.wait()
+        command += ["-w", str(basis_fn)]
+    for k, v in solver_options.items():
+        command += [f"-{k}", str(v)]
 
-    f = open(solution_fn)
+    # with a log file, glpsol writes the log itself
+    run_command(command, os.devnull if log_fn is not None else None)
 
     def read_until_break(f):
-        linebreak = False
-        while not linebreak:
-            line = f.readline()
-            linebreak = line == "\n"
-            yield line
-
-    info = io.StringIO("".join(read_until_break(f))[:-2])
-    info = pd.read_csv(info, sep=":", index_col=0, header=None)[1]
-    termination_condition = info.Status.lower().strip()
-    objective = float(re.sub(r"[^0-9\.\+\-e]+", "", info.Objective))
-
-    if termination_condition in ["optimal", "integer optimal"]:
-        status = "ok"
-        termination_condition = "optimal"
-    elif termination_condition == "undefined":
-        status = "warning"
-        termination_condition = "infeasible"
-    else:
-        status = "warning"
-
-    if termination_condition != "optimal":
-        return dict(status=status, termination_condition=termination_condition)
-
-    dual_ = io.StringIO("".join(read_until_break(f))[:-2])
-    dual_ = pd.read_fwf(dual_)[1:].set_index("Row name")
-    if "Marginal" in dual_:
-        dual = pd.to_numeric(dual_["Marginal"], "coerce").fillna(0).pipe(set_int_index)
-    else:
-        logger.warning("Dual values of MILP couldn't be parsed")
-        dual = None
-
-    solution = io.StringIO("".join(read_until_break(f))[:-2])
-    solution = (
-        pd.read_fwf(solution)[1:]
-        .set_index("Column name")["Activity"]
-        .astype(float)
-        .pipe(set_int_index)
-    )
-    f.close()
+        return io.StringIO("".join(takewhile(lambda line: line != "\n", f))[:-1])
+
+    with open(solution_fn) as f:
+        info = read_until_break(f)
+        info = pd.read_csv(info, sep=":", index_col=0, header=None)[1]
+        termination_condition = info.Status.lower().strip()
+        objective = float(_NUMBER_FILTER.sub("", info.Objective))
+
+        if termination_condition in ["optimal", "integer optimal"]:
+            status = "ok"
+            termination_condition = "optimal"
+        elif termination_condition == "undefined":
+            status = "warning"
+            termination_condition = "infeasible"
+        else:
+            status = "warning"
+
+        if termination_condition != "optimal":
+            return dict(status=status, termination_condition=termination_condition)
+
+        dual_ = pd.read_fwf(read_until_break(f))[1:].set_index("Row name")
+        if "Marginal" in dual_:
+            dual = (
+                pd.to_numeric(dual_["Marginal"], "coerce").fillna(0).pipe(set_int_index)
+            )
+        else:
+            logger.warning("Dual values of MILP couldn't be parsed")
+            dual = None
+
+        solution = (
+            pd.read_fwf(read_until_break(f))[1:]
+            .set_index("Column name")["Activity"]
+            .astype(float)
+            .pipe(set_int_index)
+        )
 
     return dict(
         status=status,
@@ -297,6 +537,8 @@ def run_highs(
 
         * presolve : "choose" by default - "on"/"off" are alternatives.
         * solver :"choose" by default - "simplex"/"ipm" are alternatives.
+          Racing both methods is not supported as a running highspy
+          solve cannot be interrupted.
         * parallel : "choose" by default - "on"/"off" are alternatives.
         * time_limit : inf by default.
 
@@ -376,6 +618,10 @@ def run_cplex(
     Note if you pass additional solver_options, the key can specify deeper
     layered parameters, use a dot as a separator here,
     i.e. `**{'aa.bb.cc' : x}`.
+
+    For LPs where neither simplex nor barrier dominates, cplex can run
+    them concurrently and return the first finished one, set
+    `**{'lpmethod': 6}` for this.
     """
     if io_api is not None and (io_api != "lp"):
         logger.warning(
@@ -384,6 +630,9 @@ def run_cplex(
         )
 
     Model.to_file(problem_fn)
+    basis_key, warmstart_fn, basis_fn = lookup_basis(
+        "cplex", problem_fn, warmstart_fn, basis_fn, Model.solver_dir
+    )
 
     m = cplex.Cplex()
 
@@ -422,6 +671,7 @@ def run_cplex(
         termination_condition = "optimal"
     else:
         status = "warning"
+        store_basis(basis_key, basis_fn, success=False)
         return dict(status=status, termination_condition=termination_condition)
 
     if (status == "ok") and basis_fn and is_lp:
@@ -429,6 +679,7 @@ def run_cplex(
             m.solution.basis.write(basis_fn)
         except cplex.exceptions.errors.CplexSolverError:
             logger.info("No model basis stored")
+    store_basis(basis_key, basis_fn)
 
     objective = m.solution.get_objective_value()
 
@@ -467,6 +718,10 @@ def run_gurobi(
     Solve a linear problem using the gurobi solver.
 
     This function communicates with gurobi using the gurubipy package.
+
+    For LPs where neither simplex nor barrier dominates, gurobi can run
+    them concurrently and return the first finished one, set `Method=3`
+    (deterministic: `Method=4`) for this.
     """
     # disable logging for this part, as gurobi output is doubled otherwise
     logging.disable(50)
@@ -475,8 +730,12 @@ def run_gurobi(
     warmstart_fn = maybe_convert_path(warmstart_fn)
     basis_fn = maybe_convert_path(basis_fn)
 
+    basis_key = None
     if io_api is None or (io_api == "lp"):
         problem_fn = Model.to_file(problem_fn)
+        basis_key, warmstart_fn, basis_fn = lookup_basis(
+            "gurobi", problem_fn, warmstart_fn, basis_fn, Model.solver_dir
+        )
         problem_fn = maybe_convert_path(problem_fn)
         m = gurobipy.read(problem_fn)
     elif io_api == "direct":
@@ -504,11 +763,7 @@ def run_gurobi(
         except gurobipy.GurobiError as err:
             logger.info("No model basis stored. Raised error: ", err)
 
-    Status = gurobipy.GRB.Status
-    statusmap = {
-        getattr(Status, s): s.lower() for s in Status.__dir__() if not s.startswith("_")
-    }
-    termination_condition = statusmap[m.status]
+    termination_condition = _GUROBI_STATUSMAP[m.status]
 
     if termination_condition == "optimal":
         status = "ok"
@@ -520,6 +775,8 @@ def run_gurobi(
     else:
         status = "warning"
 
+    store_basis(basis_key, basis_fn, termination_condition == "optimal")
+
     if termination_condition not in ["optimal", "suboptimal"]:
         return dict(
             status=status,
@@ -529,13 +786,16 @@ def run_gurobi(
 
     objective = m.ObjVal
 
-    solution = pd.Series({v.VarName: v.x for v in m.getVars()})
+    # bulk attribute queries avoid one python call per variable/constraint
+    vars = m.getVars()
+    solution = pd.Series(m.getAttr("X", vars), m.getAttr("VarName", vars))
     solution = set_int_index(solution)
 
     try:
-        dual = pd.Series({c.ConstrName: c.Pi for c in m.getConstrs()})
+        cons = m.getConstrs()
+        dual = pd.Series(m.getAttr("Pi", cons), m.getAttr("ConstrName", cons))
         dual = set_int_index(dual)
-    except AttributeError:
+    except (AttributeError, gurobipy.GurobiError):
         logger.warning("Dual values of MILP couldn't be parsed")
         dual = None
 
@@ -578,6 +838,9 @@ def run_xpress(
         )
 
     problem_fn = Model.to_file(problem_fn)
+    basis_key, warmstart_fn, basis_fn = lookup_basis(
+        "xpress", problem_fn, warmstart_fn, basis_fn, Model.solver_dir
+    )
 
     m = xpress.problem()
 
@@ -605,34 +868,30 @@ def run_xpress(
 
     termination_condition = m.getProbStatusString()
 
-    if termination_condition == "mip_optimal" or termination_condition == "lp_optimal":
+    if termination_condition in _XPRESS_OPTIMAL:
         status = "ok"
         termination_condition = "optimal"
-    elif (
-        termination_condition == "mip_unbounded"
-        or termination_condition == "mip_infeasible"
-        or termination_condition == "lp_unbounded"
-        or termination_condition == "lp_infeasible"
-        or termination_condition == "lp_infeas"
-    ):
+    elif termination_condition in _XPRESS_INFEASIBLE_OR_UNBOUNDED:
         status = "warning"
         termination_condition = "infeasible or unbounded"
     else:
         status = "warning"
 
+    store_basis(basis_key, basis_fn, termination_condition == "optimal")
+
     if termination_condition not in ["optimal"]:
         return dict(status=status, termination_condition=termination_condition)
 
     objective = m.getObjVal()
 
-    var = [str(v) for v in m.getVariable()]
+    var = m.getnamelist(2, 0, m.attributes.cols - 1)
 
-    solution = pd.Series(m.getSolution(var), index=var)
+    solution = pd.Series(m.getSolution(), index=var)
     solution = set_int_index(solution)
 
     try:
-        dual = [str(d) for d in m.getConstraint()]
-        dual = pd.Series(m.getDual(dual), index=dual)
+        dual = m.getnamelist(1, 0, m.attributes.rows - 1)
+        dual = pd.Series(m.getDual(), index=dual)
         dual = set_int_index(dual)
     except xpress.SolverError:
         logger.warning("Dual values of MILP couldn't be parsed")
@@ -6,9 +6,9 @@ This module contains variable related definitions of the package.
 """
 
 import functools
-import re
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from distutils.log import warn
+from itertools import chain
 from typing import Any, Sequence, Union
 from warnings import warn
 
@@ -18,6 +18,8 @@ import pandas as pd
 from deprecation import deprecated
 from numpy import floating, inf, issubdtype
 from xarray import DataArray, Dataset, zeros_like
+from xarray.core import formatting
+from xarray.core.options import OPTIONS
 
 import linopy.expressions as expressions
 from linopy.common import (
@@ -25,15 +27,23 @@ from linopy.common import (
     has_assigned_model,
     has_optimized_model,
     is_constant,
+    ravel_and_filter,
 )
 
 
+def _is_identical(a, b):
+    """
+    Check whether two sequences hold the very same objects.
+    """
+    return len(a) == len(b) and all(x is y for x, y in zip(a, b))
+
+
 def varwrap(method, *default_args, **new_default_kwargs):
     @functools.wraps(method)
     def _varwrap(obj, *args, **kwargs):
-        for k, v in new_default_kwargs.items():
-            kwargs.setdefault(k, v)
-        obj = DataArray(obj)
+        # forward the variable itself, the xarray methods are inherited
+        if new_default_kwargs:
+            kwargs = {**new_default_kwargs, **kwargs}
         return Variable(method(obj, *default_args, *args, **kwargs))
 
     _varwrap.__doc__ = f"Wrapper for the xarray {method} function for linopy.Variable"
@@ -92,14 +102,24 @@ class Variable(DataArray):
     Further operations like taking the negative and subtracting are supported.
     """
 
-    __slots__ = ("_cache", "_coords", "_indexes", "_name", "_variable", "model")
+    __slots__ = (
+        "_cache",
+        "_coords",
+        "_indexes",
+        "_name",
+        "_variable",
+        "model",
+        "_linexpr",
+        "_indexes_cache",
+    )
 
     def __init__(self, *args, **kwargs):
 
         # workaround until https://github.com/pydata/xarray/pull/5984 is merged
         if isinstance(args[0], DataArray):
             da = args[0]
-            args = (da.data, da.coords)
+            # pass the underlying variable to avoid re-wrapping the data
+            args = (da.variable, da.coords)
             kwargs.update({"attrs": da.attrs, "name": da.name})
 
         self.model = kwargs.pop("model", None)
@@ -125,9 +145,17 @@ class Variable(DataArray):
         if not self.ndim:
             return ScalarVariable(self.data.item())
         assert self.ndim == len(keys), f"expected {self.ndim} keys, got {len(keys)}."
-        key = dict(zip(self.dims, keys))
-        selector = [self.get_index(k).get_loc(v) for k, v in key.items()]
-        return ScalarVariable(self.data[tuple(selector)])
+        # the pandas indexes are looked up once per state of the xarray
+        # indexes of the dimensions, which can be modified in place
+        key = tuple((self._indexes or {}).get(dim) for dim in self.dims)
+        cached = getattr(self, "_indexes_cache", None)
+        if cached is not None and _is_identical(cached[0], key):
+            indexes = cached[1]
+        else:
+            indexes = tuple(self.get_index(dim) for dim in self.dims)
+            self._indexes_cache = (key, indexes)
+        selector = tuple(index.get_loc(k) for index, k in zip(indexes, keys))
+        return ScalarVariable(self.data[selector])
 
     def to_array(self):
         """
@@ -141,6 +169,22 @@ class Variable(DataArray):
         """
         if isinstance(coefficient, (expressions.LinearExpression, Variable)):
             raise TypeError(f"unsupported type of coefficient: {type(coefficient)}")
+        if type(coefficient) is int and coefficient == 1:
+            # used by most arithmetic operations, build it only once per state
+            # of the data and coordinates, which can be modified in place
+            key = (
+                self._variable,
+                self._variable._data,
+                *chain.from_iterable(self._coords.items()),
+            )
+            cached = getattr(self, "_linexpr", None)
+            if cached is not None and _is_identical(cached[0], key):
+                expr = cached[1]
+            else:
+                expr = expressions.LinearExpression.from_tuples((1, self))
+                self._linexpr = (key, expr)
+            # expressions are mutable datasets, do not hand out the cached one
+            return expr.copy(deep=False)
         return expressions.LinearExpression.from_tuples((coefficient, self))
 
     def __repr__(self):
@@ -212,8 +256,8 @@ class Variable(DataArray):
         """
         Add variables to linear expressions or other variables.
         """
-        if isinstance(
-            other, (Variable, DataArray, pd.DataFrame, pd.Series, np.ndarray)
+        if type(other) in _ARRAYLIKE_TYPES or isinstance(
+            other, (DataArray, pd.DataFrame, pd.Series, np.ndarray)
         ):
             return expressions.LinearExpression.from_tuples((1, self), (1, other))
         elif isinstance(other, expressions.LinearExpression):
@@ -305,7 +349,11 @@ class Variable(DataArray):
         The function raises an error in case no model is set as a
         reference.
         """
-        value = DataArray(value).broadcast_like(self)
+        if not isinstance(value, DataArray):
+            value = DataArray(value)
+        # aligned arrays are assigned as they are, otherwise broadcast
+        if value.dims != self.dims or value.shape != self.shape:
+            value = value.broadcast_like(self)
         self.model.variables.upper[self.name] = value
 
     @property
@@ -329,7 +377,11 @@ class Variable(DataArray):
         The function raises an error in case no model is set as a
         reference.
         """
-        value = DataArray(value).broadcast_like(self)
+        if not isinstance(value, DataArray):
+            value = DataArray(value)
+        # aligned arrays are assigned as they are, otherwise broadcast
+        if value.dims != self.dims or value.shape != self.shape:
+            value = value.broadcast_like(self)
         self.model.variables.lower[self.name] = value
 
     @property
@@ -421,17 +473,26 @@ class Variable(DataArray):
     rolling = varwrap(DataArray.rolling)
 
 
+# exact types which are added to variables as terms, subclasses of them are
+# caught by an additional isinstance check
+_ARRAYLIKE_TYPES = frozenset({Variable, DataArray, pd.DataFrame, pd.Series, np.ndarray})
+
+
 @dataclass(repr=False)
 class Variables:
     """
     A variables container used for storing multiple variable arrays.
     """
 
-    labels: Dataset = Dataset()
-    lower: Dataset = Dataset()
-    upper: Dataset = Dataset()
-    blocks: Dataset = Dataset()
+    labels: Dataset = field(default_factory=Dataset)
+    lower: Dataset = field(default_factory=Dataset)
+    upper: Dataset = field(default_factory=Dataset)
+    blocks: Dataset = field(default_factory=Dataset)
     model: Any = None  # Model is not defined due to circular imports
+    # sorted (names, first labels, last labels), built on demand
+    _label_index: Any = field(default=None, init=False, repr=False, compare=False)
+    # number of non-missing labels, counted on first access of `nvars`
+    _nvars: Any = field(default=None, init=False, repr=False, compare=False)
 
     dataset_attrs = ["labels", "lower", "upper"]
     dataset_names = ["Labels", "Lower bounds", "Upper bounds"]
@@ -453,14 +514,36 @@ class Variables:
         r = "linopy.model.Variables"
         line = "-" * len(r)
         r += f"\n{line}\n\n"
-        # matches string between "Data variables" and "Attributes"/end of string
-        coordspattern = r"(?s)(?<=\<xarray\.Dataset\>\n).*?(?=Data variables:)"
-        datapattern = r"(?s)(?<=Data variables:).*?(?=($|\nAttributes))"
+        max_rows = OPTIONS["display_max_rows"]
         for (k, K) in zip(self.dataset_attrs, self.dataset_names):
-            orig = getattr(self, k).__repr__()
+            ds = getattr(self, k)
+            # assemble the dataset repr from its parts, this does not compute
+            # dask arrays and skips the full repr of each dataset. The col
+            # width helpers are private to xarray, the output is tested
+            # against the Dataset repr in test_variable.py
+            col_width = formatting._calculate_col_width(
+                formatting._get_col_items(ds.variables)
+            )
             if k == "labels":
-                r += re.search(coordspattern, orig).group() + "\n"
-            data = re.search(datapattern, orig).group()
+                dims_start = formatting.pretty_print("Dimensions:", col_width)
+                dims_values = formatting.dim_summary_limited(
+                    ds, col_width=col_width + 1, max_rows=max_rows
+                )
+                r += f"{dims_start}({dims_values})\n"
+                if ds.coords:
+                    coords = formatting.coords_repr(
+                        ds.coords, col_width=col_width, max_rows=max_rows
+                    )
+                    r += coords + "\n"
+                unindexed = formatting.unindexed_dims_repr(
+                    ds.dims, ds.coords, max_rows=max_rows
+                )
+                if unindexed:
+                    r += unindexed + "\n"
+                r += "\n"
+            data = formatting.data_vars_repr(
+                ds.data_vars, col_width=col_width, max_rows=max_rows
+            )
             # drop first line which includes counter for long ds
             data = data.split("\n", 1)[1]
             r += f"{K}:\n{data}\n\n"
@@ -487,6 +570,9 @@ class Variables:
         self._merge_inplace("labels", labels, name, fill_value=-1)
         self._merge_inplace("lower", lower, name, fill_value=-inf)
         self._merge_inplace("upper", upper, name, fill_value=inf)
+        self._label_index = None
+        if self._nvars is not None:
+            self._nvars += int((labels.values != -1).sum())
 
     def remove(self, name):
         """
@@ -496,6 +582,8 @@ class Variables:
             ds = getattr(self, attr)
             if name in ds:
                 setattr(self, attr, ds.drop_vars(name))
+        self._label_index = None
+        self._nvars = None
 
     @property
     def nvars(self):
@@ -505,15 +593,17 @@ class Variables:
 
         These also include variables with missing labels.
         """
-        return self.ravel("labels", filter_missings=True).shape[0]
+        if self._nvars is None:
+            self._nvars = self.ravel("labels", filter_missings=True).shape[0]
+        return self._nvars
 
     @property
     def _binary_variables(self):
-        return [v for v in self if self[v].attrs["binary"]]
+        return [v for v, da in self.labels.items() if da.attrs["binary"]]
 
     @property
     def _non_binary_variables(self):
-        return [v for v in self if not self[v].attrs["binary"]]
+        return [v for v, da in self.labels.items() if not da.attrs["binary"]]
 
     @property
     def binaries(self):
@@ -551,12 +641,28 @@ class Variables:
         """
         if not isinstance(label, (float, int)) or label < 0:
             raise ValueError("Label must be a positive number.")
-        for name, labels in self.labels.items():
-            if label in labels:
-                return name
+
+        if self._label_index is None:
+            ranges = []
+            for name in self.labels:
+                labels = self.labels.variables[name].values
+                labels = labels[labels != -1]
+                if labels.size:
+                    ranges.append((labels.min(), labels.max(), name))
+            ranges.sort()
+            starts = np.array([r[0] for r in ranges], dtype=int)
+            ends = np.array([r[1] for r in ranges], dtype=int)
+            self._label_index = ([r[2] for r in ranges], starts, ends)
+
+        # label ranges of variables do not overlap, masked labels may be holes
+        names, starts, ends = self._label_index
+        i = np.searchsorted(starts, label, side="right") - 1
+        if i >= 0 and label <= ends[i]:
+            if (self.labels.variables[names[i]].values == label).any():
+                return names[i]
         raise ValueError(f"No variable found containing the label {label}.")
 
-    def iter_ravel(self, key, filter_missings=False):
+    def iter_ravel(self, key, filter_missings=False, out=None, masks=None):
         """
         Create an generator which iterates over all arrays in `key` and
         flattens them.
@@ -570,7 +676,14 @@ class Variables:
             Filter out values where the variables labels are -1. This will
             raise an error if the filtered data still contains nan's.
             When enabled, the data is loaded into memory. The default is False.
-
+        out : np.array, optional
+            Buffer to which the filtered arrays are written consecutively,
+            the yielded arrays are views into it. Only used if
+            `filter_missings` is True. The default is None.
+        masks : list of np.array, optional
+            Boolean masks of the non-missing labels, one per variable. Only
+            used if `filter_missings` is True, otherwise the masks are
+            derived from the labels. The default is None.
 
         Yields
         ------
@@ -583,16 +696,37 @@ class Variables:
         else:
             raise TypeError("Argument `key` must be of type string or xarray.Dataset")
 
-        for name, labels in self.labels.items():
-
-            broadcasted = ds[name].broadcast_like(labels)
+        # work on the underlying variables, this avoids creating a DataArray
+        # with all coordinates per item
+        label_variables = self.labels.variables
+        variables = ds.variables
+
+        offset = 0
+        for i, name in enumerate(self.labels):
+            labels = label_variables[name]
+            broadcasted = variables[name]
+            # all datasets of the container share the same coordinates, only
+            # broadcast if the arrays differ in their dimensions
+            if broadcasted.dims != labels.dims or broadcasted.shape != labels.shape:
+                broadcasted = ds[name].broadcast_like(self.labels[name]).variable
             if labels.chunks is not None:
-                broadcasted = broadcasted.chunk(labels.chunks)
+                if filter_missings:
+                    # data is loaded anyway, evaluate the graphs only once
+                    broadcasted, labels = dask.compute(broadcasted, labels)
+                else:
+                    broadcasted = broadcasted.chunk(labels.chunks)
 
             if filter_missings:
-                flat = np.ravel(broadcasted)
-                flat = flat[np.ravel(labels) != -1]
-                if pd.isna(flat).any():
+                mask = labels.values != -1 if masks is None else masks[i]
+                dest = None
+                if out is not None:
+                    size = np.count_nonzero(mask)
+                    dest = out[offset : offset + size]
+                    offset += size
+                flat, has_nan = ravel_and_filter(
+                    broadcasted.values, labels.values, dest, mask
+                )
+                if has_nan:
                     ds_name = self.dataset_names[self.dataset_attrs.index(key)]
                     err = f"{ds_name} of variable '{name}' contains nan's."
                     raise ValueError(err)
@@ -624,6 +758,20 @@ class Variables:
         flat
             One dimensional data with all values in `key`.
         """
+        labels = [self.labels.variables[name] for name in self.labels]
+        in_memory = all(lab.chunks is None for lab in labels)
+        if filter_missings and in_memory and len(labels):
+            # filtered data is in memory, write it directly to one buffer
+            # instead of concatenating the single arrays
+            ds = getattr(self, key) if isinstance(key, str) else key
+            masks = [lab.values != -1 for lab in labels]
+            size = sum(np.count_nonzero(mask) for mask in masks)
+            dtype = np.result_type(*[ds.variables[name].dtype for name in self.labels])
+            res = np.empty(size, dtype=dtype)
+            for _ in self.iter_ravel(key, filter_missings, out=res, masks=masks):
+                pass
+            return res
+
         res = np.concatenate(list(self.iter_ravel(key, filter_missings)))
         if compute:
             return dask.compute(res)[0]
@@ -637,10 +785,16 @@ class Variables:
         dim = blocks.dims[0]
         assert dim in self.labels.dims, "Block dimension not in variables."
 
-        block_map = zeros_like(self.labels, dtype=blocks.dtype)
-        for name, variable in self.labels.items():
-            if dim in variable.dims:
-                block_map[name] = blocks.broadcast_like(variable)
+        # create the dataset at once, variables without the block dimension
+        # are assigned to block 0
+        block_map = Dataset(
+            {
+                name: blocks.broadcast_like(labels)
+                if dim in labels.dims
+                else zeros_like(labels, dtype=blocks.dtype)
+                for name, labels in self.labels.items()
+            }
+        )
         return block_map.where(self.labels != -1, -1)
 
     def blocks_to_blockmap(self, block_map, dtype=np.int8):
@@ -648,10 +802,14 @@ class Variables:
         Get a one-dimensional array mapping the variables to blocks.
         """
         # non-assigned variables are assumed to be masked, insert -1
-        res = np.full(self.model._xCounter + 1, -1, dtype=dtype)
-        for name, labels in self.labels.items():
-            res[np.ravel(labels)] = np.ravel(block_map[name])
-        res[-1] = -1
+        res = np.empty(self.model._xCounter + 1, dtype=dtype)
+        res.fill(-1)
+        if not len(self.labels):
+            return res
+        labels = np.concatenate([np.ravel(v) for v in self.labels.values()])
+        blocks = np.concatenate([np.ravel(block_map[name]) for name in self.labels])
+        not_missing = labels != -1
+        res[labels[not_missing]] = blocks[not_missing]
         return res
 
 
@@ -54,6 +54,7 @@ setup(
             "pytest-cov",
             "pre-commit",
             "paramiko",
+            "numba",
             "gurobipy",
             # until available for windows/mac
             # "highspy",
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the linopy common module.
+"""
+
+import numpy as np
+import pytest
+
+from linopy.common import _numba_kernels, _remap, ravel_and_filter
+
+
+@pytest.mark.parametrize("size", [100, 200_000])
+def test_remap(size):
+    rng = np.random.default_rng(0)
+    mapping = rng.random(1000)
+    array = rng.integers(-1, 1000, size=(size // 100, 100))
+    res = _remap(array, mapping)
+    assert res.shape == array.shape
+    np.testing.assert_array_equal(res, mapping[array])
+
+
+def test_remap_numba():
+    pytest.importorskip("numba")
+
+    assert _numba_kernels() is not None
+    rng = np.random.default_rng(0)
+    mapping = rng.integers(0, 10, size=1000)
+    array = rng.integers(-1, 1000, size=(2000, 100))
+    np.testing.assert_array_equal(_remap(array, mapping), mapping[array])
+
+
+def masked_data(size, dtype, seed=0):
+    rng = np.random.default_rng(seed)
+    shape = (size // 100, 100)
+    values = rng.integers(0, 2, size=shape).astype(dtype)
+    labels = np.arange(size).reshape(shape)
+    labels[rng.random(shape) < 0.3] = -1
+    return values, labels
+
+
+# small arrays are filtered with numpy, large ones with numba if installed
+@pytest.mark.parametrize("size", [100, 200_000])
+@pytest.mark.parametrize("dtype", [float, int, bool])
+def test_ravel_and_filter(size, dtype):
+    values, labels = masked_data(size, dtype)
+    flat, has_nan = ravel_and_filter(values, labels)
+    assert flat.dtype == values.dtype
+    np.testing.assert_array_equal(flat, values[labels != -1])
+    assert not has_nan
+
+
+@pytest.mark.parametrize("size", [100, 200_000])
+def test_ravel_and_filter_nan(size):
+    values, labels = masked_data(size, float)
+    masked = np.argwhere(labels == -1)[0]
+    values[tuple(masked)] = np.nan
+    flat, has_nan = ravel_and_filter(values, labels)
+    assert not has_nan
+    np.testing.assert_array_equal(flat, values[labels != -1])
+
+    unmasked = np.argwhere(labels != -1)[-1]
+    values[tuple(unmasked)] = np.nan
+    flat, has_nan = ravel_and_filter(values, labels)
+    assert has_nan
+    assert np.isnan(flat[-1])
+
+
+@pytest.mark.parametrize("size", [100, 200_000])
+def test_ravel_and_filter_out(size):
+    values, labels = masked_data(size, int)
+    out = np.empty(np.count_nonzero(labels != -1), dtype=float)
+    flat, has_nan = ravel_and_filter(values, labels, out)
+    assert flat is out
+    np.testing.assert_array_equal(out, values[labels != -1])
+    assert not has_nan
+
+    out = np.empty(out.size, dtype=int)
+    flat, has_nan = ravel_and_filter(values, labels, out)
+    assert flat is out
+    np.testing.assert_array_equal(out, values[labels != -1])
+
+
+@pytest.mark.parametrize("size", [100, 200_000])
+def test_ravel_and_filter_mask(size):
+    values, labels = masked_data(size, float)
+    mask = labels != -1
+    out = np.empty(np.count_nonzero(mask))
+    flat, has_nan = ravel_and_filter(values, labels, out, mask)
+    assert flat is out
+    np.testing.assert_array_equal(out, values[mask])
+    assert not has_nan
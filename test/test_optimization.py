@@ -6,13 +6,22 @@ Created on Thu Mar 18 08:49:08 2021.
 @author: fabian
 """
 
+import os
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
 import pytest
 from xarray.testing import assert_equal
 
 from linopy import Model
-from linopy.solvers import available_solvers
+from linopy.solvers import (
+    available_solvers,
+    clear_basis_cache,
+    get_solution_cache_dir,
+    lookup_basis,
+    store_basis,
+)
 
 params = [(name, "lp") for name in available_solvers]
 if "gurobi" in available_solvers:
@@ -288,6 +297,74 @@ def test_basis_and_warmstart(tmp_path, model, solver, io_api):
     model.solve(solver, warmstart_fn=basis_fn)
 
 
+@pytest.mark.parametrize("solver,io_api", params)
+def test_solution_cache(tmp_path, monkeypatch, model, solver, io_api):
+    monkeypatch.setenv("LINOPY_CACHE_SOLVES", "1")
+    monkeypatch.setenv("LINOPY_CACHE", str(tmp_path))
+
+    model.solve(solver, io_api=io_api)
+    assert len(list(tmp_path.glob("*.pkl"))) == 1
+    solution = model.solution
+
+    model.solve(solver, io_api=io_api)
+    assert len(list(tmp_path.glob("*.pkl"))) == 1
+    assert np.isclose(model.objective_value, 3.3)
+    assert_equal(model.solution, solution)
+
+    model.variables.lower["x"] = 1
+    model.solve(solver, io_api=io_api)
+    assert len(list(tmp_path.glob("*.pkl"))) == 2
+
+    # requested solver files bypass the cache
+    model.variables.lower["x"] = 2
+    log_fn = tmp_path / "solver.log"
+    model.solve(solver, io_api=io_api, log_fn=log_fn)
+    assert len(list(tmp_path.glob("*.pkl"))) == 2
+    assert log_fn.exists()
+
+
+def test_basis_cache(tmp_path, monkeypatch):
+    problem_fn = tmp_path / "problem.lp"
+    problem_fn.write_text("min: x;")
+
+    # disabled by default, the problem file is not touched
+    res = lookup_basis("cbc", problem_fn, None, None, tmp_path)
+    assert res == (None, None, None)
+
+    monkeypatch.setenv("LINOPY_CACHE_BASIS", "1")
+    key, warmstart_fn, basis_fn = lookup_basis("cbc", problem_fn, None, None, tmp_path)
+    assert key is not None and warmstart_fn is None
+    Path(basis_fn).write_text("basis")
+    store_basis(key, basis_fn)
+
+    # identical problem files reuse the basis, modified ones do not
+    _, warmstart_fn, _ = lookup_basis("cbc", problem_fn, None, None, tmp_path)
+    assert warmstart_fn == basis_fn
+    problem_fn.write_text("min: 2 x;")
+    key, warmstart_fn, other_basis_fn = lookup_basis(
+        "cbc", problem_fn, None, None, tmp_path
+    )
+    assert warmstart_fn is None
+    store_basis(key, other_basis_fn, success=False)
+    assert not Path(other_basis_fn).exists()
+
+    clear_basis_cache()
+    assert not Path(basis_fn).exists()
+
+
+@pytest.mark.skipif(os.name != "posix", reason="permission check only on posix")
+def test_solution_cache_unsafe_dir(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    cache_dir.chmod(0o777)
+    monkeypatch.setenv("LINOPY_CACHE_SOLVES", "1")
+    monkeypatch.setenv("LINOPY_CACHE", str(cache_dir))
+    assert get_solution_cache_dir() is None
+
+    cache_dir.chmod(0o700)
+    assert get_solution_cache_dir() == cache_dir
+
+
 # def init_model_large():
 #     m = Model()
 #     time = pd.Index(range(10), name="time")
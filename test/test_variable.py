@@ -6,6 +6,8 @@ Created on Tue Nov  2 22:36:38 2021.
 @author: fabian
 """
 
+import re
+
 import numpy as np
 import pandas as pd
 import pytest
@@ -31,6 +33,18 @@ def test_variable_getter():
         x[[1, 2, 3]]
 
 
+def test_variable_getter_after_coords_update():
+    m = Model()
+    y = m.add_variables(coords=[pd.Index([10, 20, 30], name="t")])
+    assert y[20].label == 1
+
+    y.coords["t"] = [20, 30, 40]
+    assert y[20].label == 0
+
+    del y.coords["t"]
+    assert y[2].label == 2
+
+
 def test_variable_repr():
     m = Model()
     m.variables.__repr__()
@@ -48,6 +62,37 @@ def test_variable_repr():
     m.variables.__repr__()
 
 
+def dataset_repr_sections(variables):
+    # reference repr assembled from the sections of xarray's own Dataset repr
+    coordspattern = r"(?s)(?<=\<xarray\.Dataset\>\n).*?(?=Data variables:)"
+    datapattern = r"(?s)(?<=Data variables:).*?(?=($|\nAttributes))"
+    r = "linopy.model.Variables\n----------------------\n\n"
+    for k, K in zip(variables.dataset_attrs, variables.dataset_names):
+        orig = getattr(variables, k).__repr__()
+        if k == "labels":
+            r += re.search(coordspattern, orig).group() + "\n"
+        data = re.search(datapattern, orig).group().split("\n", 1)[1]
+        r += f"{K}:\n{data}\n\n"
+    return r
+
+
+@pytest.mark.parametrize("chunk", [None, 2])
+def test_variables_repr_matches_dataset_repr(chunk):
+    m = Model(chunk=chunk)
+    assert repr(m.variables) == dataset_repr_sections(m.variables)
+
+    time = pd.Index(range(3), name="time")
+    m.add_variables(coords=[time], name="x")
+    m.add_variables(0, coords=[time, pd.Index(["a", "b"], name="s")], name="y")
+    m.add_variables(name="a_rather_long_variable_name")
+    assert repr(m.variables) == dataset_repr_sections(m.variables)
+
+    # more variables than xarray displays by default
+    for i in range(20):
+        m.add_variables(coords=[time], name=f"v{i}")
+    assert repr(m.variables) == dataset_repr_sections(m.variables)
+
+
 def test_variable_bound_accessor():
     m = Model()
     x = m.add_variables(0, 10)
@@ -89,15 +134,44 @@ def test_variable_sum():
     assert res.nterm == 10
 
 
+def test_variable_to_linexpr():
+    m = Model()
+    x = m.add_variables(coords=[range(10)])
+    expr = x.to_linexpr()
+    assert isinstance(expr, linopy.LinearExpression)
+    assert (expr.vars.values.ravel() == x.values).all()
+    assert (expr.coeffs == 1).all()
+
+    # modifying a returned expression must not affect later expressions
+    expr["coeffs"] = expr.coeffs * 5
+    assert (x.to_linexpr().coeffs == 1).all()
+    assert (x.sum().coeffs == 1).all()
+    assert ((1 * x).coeffs == 1).all()
+
+    expr = x.to_linexpr(2)
+    assert (expr.coeffs == 2).all()
+
+    # reassigning coordinates must be reflected by later expressions
+    x = m.add_variables(coords=[pd.Index([10, 20, 30], name="t")])
+    x.to_linexpr()
+    x.coords["t"] = [20, 30, 40]
+    assert list((1 * x).coords["t"].values) == [20, 30, 40]
+    del x.coords["t"]
+    assert "t" not in (1 * x).coords
+
+
 def test_nvars():
     m = Model()
     m.add_variables(coords=[range(10)])
     assert m.variables.nvars == 10
 
     mask = pd.Series([True] * 5 + [False] * 5)
-    m.add_variables(coords=[range(10)], mask=mask)
+    m.add_variables(coords=[range(10)], mask=mask, name="y")
     assert m.variables.nvars == 15
 
+    m.remove_variables("y")
+    assert m.variables.nvars == 10
+
 
 def test_variable_where():
     m = Model()
@@ -159,3 +233,20 @@ def test_get_name_by_label():
 
     with pytest.raises(ValueError):
         m.variables.get_name_by_label("asd")
+
+
+def test_get_name_by_label_masked():
+    m = Model()
+    mask = pd.Series([True] * 5 + [False] * 5)
+    m.add_variables(coords=[range(10)], name="x", mask=mask)
+    m.add_variables(coords=[range(10)], name="y")
+
+    assert m.variables.get_name_by_label(4) == "x"
+    assert m.variables.get_name_by_label(10) == "y"
+
+    with pytest.raises(ValueError):
+        m.variables.get_name_by_label(7)
+
+    m.remove_variables("x")
+    with pytest.raises(ValueError):
+        m.variables.get_name_by_label(4)